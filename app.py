@@ -25,73 +25,133 @@ import app
 
 from .utils import parse_version
 
+try:
+    import micropython
+    from micropython import const
+except ImportError:
+    # not running on MicroPython (e.g. in the simulator)
+    class micropython:
+        # @micropython.native is consumed by the MicroPython compiler, elsewhere it has no effect
+        @staticmethod
+        def native(func):
+            return func
+    def const(value):
+        return value
+
 _APP_VERSION = "1.0" # XYStage App Version Number
 
+# Button types - looked up once rather than on every frame
+_BTN_CANCEL  = BUTTON_TYPES["CANCEL"]
+_BTN_CONFIRM = BUTTON_TYPES["CONFIRM"]
+_BTN_UP      = BUTTON_TYPES["UP"]
+_BTN_DOWN    = BUTTON_TYPES["DOWN"]
+_BTN_LEFT    = BUTTON_TYPES["LEFT"]
+_BTN_RIGHT   = BUTTON_TYPES["RIGHT"]
+
+# Button bits for the bitmask returned by XYStageApp._get_buttons()
+_BTN_ORDER   = (_BTN_CANCEL, _BTN_CONFIRM, _BTN_UP, _BTN_DOWN, _BTN_LEFT, _BTN_RIGHT)
+_MASK_CANCEL  = const(0x01)
+_MASK_CONFIRM = const(0x02)
+_MASK_UP      = const(0x04)
+_MASK_DOWN    = const(0x08)
+_MASK_LEFT    = const(0x10)
+_MASK_RIGHT   = const(0x20)
+
 
 # Stepper Tester - Defaults
-_STEPPER_MAX_SPEED          = 1000*32    # steps per second
-_STEPPER_MIN_SPEED          = 10*32      # steps per second
-_STEPPER_MAX_ACCELERATION   = 100*32     # steps per second per update
-_STEPPER_MAX_POSITION       = 3100       # steps from h/w endstop to s/w endstop at the other end
+_STEPPER_MAX_SPEED          = const(1000*32)    # steps per second
+_STEPPER_MIN_SPEED          = const(10*32)      # steps per second
+_STEPPER_MAX_ACCELERATION   = const(100*32)     # steps per second per update
+_STEPPER_MAX_POSITION       = const(3100)       # steps from h/w endstop to s/w endstop at the other end
 
 # Timings
-_AUTO_REPEAT_MS = 200       # Time between auto-repeats, in ms
-_AUTO_REPEAT_COUNT_THRES = 10 # Number of auto-repeats before increasing level
-_AUTO_REPEAT_SPEED_LEVEL_MAX = 4  # Maximum level of auto-repeat speed increases
-_AUTO_REPEAT_LEVEL_MAX = 3  # Maximum level of auto-repeat digit increases
+_AUTO_REPEAT_MS = const(200)       # Time between auto-repeats, in ms
+_AUTO_REPEAT_COUNT_THRES = const(10) # Number of auto-repeats before increasing level
+_AUTO_REPEAT_SPEED_LEVEL_MAX = const(4)  # Maximum level of auto-repeat speed increases
+_AUTO_REPEAT_LEVEL_MAX = const(3)  # Maximum level of auto-repeat digit increases
+# Auto-repeat interval for each level, in ms - at the top end the loop is unlikley to cycle this fast
+_AUTO_REPEAT_INTERVALS = (_AUTO_REPEAT_MS, _AUTO_REPEAT_MS//2, _AUTO_REPEAT_MS//4, _AUTO_REPEAT_MS//8, _AUTO_REPEAT_MS//16)
+# Number of auto-repeats at each level before moving up a level - so each level lasts about the same time
+_AUTO_REPEAT_COUNT_THRESHOLDS = tuple((_AUTO_REPEAT_COUNT_THRES*_AUTO_REPEAT_MS) // i for i in _AUTO_REPEAT_INTERVALS)
+# 10**level lookup for the auto-repeat levels - speed steps use up to level _AUTO_REPEAT_SPEED_LEVEL_MAX+1
+_POW10 = tuple(10**i for i in range(_AUTO_REPEAT_SPEED_LEVEL_MAX + 2))
 
 
 # App states
-STATE_INIT = -1
-STATE_WARNING = 0
-STATE_MENU = 1
-STATE_XYSTAGE = 2
-STATE_ERROR = 3          # Hexpansion error
-STATE_MESSAGE = 4        # Message display
-STATE_SETTINGS = 5       # Edit Settings
+STATE_INIT = const(-1)
+STATE_WARNING = const(0)
+STATE_MENU = const(1)
+STATE_XYSTAGE = const(2)
+STATE_ERROR = const(3)          # Hexpansion error
+STATE_MESSAGE = const(4)        # Message display
+STATE_SETTINGS = const(5)       # Edit Settings
 
-# App states where user can minimise app
-_MINIMISE_VALID_STATES = [0, 1, 3, 4, 5]
+# App states where user can minimise app (bitmask indexed by state)
+_MINIMISE_VALID_STATES = const((1 << STATE_WARNING) | (1 << STATE_MENU) | (1 << STATE_ERROR) | (1 << STATE_MESSAGE) | (1 << STATE_SETTINGS))
 
 # Hexpansion constants
-_EEPROM_NUM_ADDRESS_BYTES = 2
+_EEPROM_NUM_ADDRESS_BYTES = const(2)
+_VALID_PORTS = (1, 2, 3, 4, 5, 6)
 
-XYSTAGE_HEXPANSION = 1  # Hexpansion slot for XYStage - as it does not have an EEPROM to be detected automatically
+XYSTAGE_HEXPANSION = const(1)  # Hexpansion slot for XYStage - as it does not have an EEPROM to be detected automatically
 # Dedicated Pins - to drive an external stepper driver
-X_DIR = 1   # ls pin (LSB)
-X_ENABLE = 0  # ls pin (LSA) - active low
-X_ENDSTOP = 3  # hs pin (HSG) - switch to ground
-X_STEP = 0  # hs pin (HSF)
-Y_DIR = 3   # ls pin (LSD)
-Y_ENABLE = 2  # ls pin (LSC) - active low
-Y_ENDSTOP = 1  # hs pin (HSI) - switch to ground
-Y_STEP = 2  # hs pin (HSH)
-
-_USABLE_X_PIXELS =  200
-_USABLE_Y_PIXELS =  140
-_WIDTH_DEFAULT   = (2000*32)
-_HEIGHT_DEFAULT  = (2000*32)
-_XRANGE_DEFAULT  = (2200*32) # Driver configured for 1/32 steps
-_YRANGE_DEFAULT  = (2000*32) # Driver configured for 1/32 steps
-POSITION_MATCH_TOLERANCE = 20
+X_DIR = const(1)   # ls pin (LSB)
+X_ENABLE = const(0)  # ls pin (LSA) - active low
+X_ENDSTOP = const(3)  # hs pin (HSG) - switch to ground
+X_STEP = const(0)  # hs pin (HSF)
+Y_DIR = const(3)   # ls pin (LSD)
+Y_ENABLE = const(2)  # ls pin (LSC) - active low
+Y_ENDSTOP = const(1)  # hs pin (HSI) - switch to ground
+Y_STEP = const(2)  # hs pin (HSH)
+
+_USABLE_X_PIXELS = const(200)
+_USABLE_Y_PIXELS = const(140)
+_WIDTH_DEFAULT   = const(2000*32)
+_HEIGHT_DEFAULT  = const(2000*32)
+_XRANGE_DEFAULT  = const(2200*32) # Driver configured for 1/32 steps
+_YRANGE_DEFAULT  = const(2000*32) # Driver configured for 1/32 steps
+POSITION_MATCH_TOLERANCE = const(20)
+_ENDSTOP_DEBOUNCE_SAMPLES = const(3)  # Consecutive closed reads (one per stepper update) needed to accept an endstop hit
+_TEXT_WIDTH_CACHE_MAX = const(32)     # Max number of text widths remembered by draw_message
+
+# MySetting value types
+_KIND_BOOL  = const(0)
+_KIND_INT   = const(1)
+_KIND_FLOAT = const(2)
+_KIND_OTHER = const(3)
 
 #Misceallaneous Settings
 _LOGGING = True
+_LOG_BUFFER_MAX = const(32)     # Max number of deferred log messages held between updates
+
+# Log messages from the stepper paths are queued here and printed from XYStageApp.update()
+# so that console output doesn't stall speed changes; messages are dropped when full
+_log_buffer = []
+
+def _log_deferred(msg: str):
+    if len(_log_buffer) < _LOG_BUFFER_MAX:
+        _log_buffer.append(msg)
 
 # Menu Items
 _main_menu_items = ["XYStage", "Settings", "About","Exit"]
 
+# Static screen content
+_WARNING_MESSAGE  = ("XYStage requires","HexDrive hexpansion","from RobotMad","github.com","/TeamRobotmad","/XYStage")
+_WARNING_COLOURS  = ((1,1,1),(1,1,0),(1,1,0),(1,1,1),(1,1,1),(1,1,1))
+_SETTINGS_COLOURS = ((1,1,1),(0,0,1),(0,1,0))
+
 class XYStageApp(app.App):
     def __init__(self):
         super().__init__()
         # UI Button Controls
         self.button_states = Buttons(self)
-        self.last_press: Button = BUTTON_TYPES["CANCEL"]
+        self.last_press: Button = _BTN_CANCEL
         self.long_press_delta: int = 0
-        self._auto_repeat_intervals = [ _AUTO_REPEAT_MS, _AUTO_REPEAT_MS//2, _AUTO_REPEAT_MS//4, _AUTO_REPEAT_MS//8, _AUTO_REPEAT_MS//16] # at the top end the loop is unlikley to cycle this fast
         self._auto_repeat: int = 0
         self._auto_repeat_count: int = 0
         self._auto_repeat_level: int = 0
+        # current interval and level promotion threshold for speed up mode, see _set_auto_repeat_level()
+        self._set_auto_repeat_level(0)
 
         # UI Feature Controls
         self._refresh: bool = True
@@ -99,18 +159,27 @@ class XYStageApp(app.App):
         self.error_message = []
         self.current_menu: str = None
         self.menu: Menu = None
+        self._text_width_cache = {}     # (font size, text) -> width
+        self._y_position_cache = {}     # (number of lines, font size) -> y position of each line
 
         # Settings
         self._settings = {}
-        self._settings['logging']       = MySetting(self._settings, _LOGGING, False, True)
-        self._settings['width']         = MySetting(self._settings, _WIDTH_DEFAULT,  10, 100000)
-        self._settings['height']        = MySetting(self._settings, _HEIGHT_DEFAULT, 10, 100000)
-        self._settings['XRange']        = MySetting(self._settings, _XRANGE_DEFAULT, 10, 100000)
-        self._settings['YRange']        = MySetting(self._settings, _YRANGE_DEFAULT, 10, 100000)
-        self._settings['min_speed']     = MySetting(self._settings, _STEPPER_MIN_SPEED, 10, 10000)
-        self._settings['max_speed']     = MySetting(self._settings, _STEPPER_MAX_SPEED, 10, 100000)
-        self._settings['acceleration']  = MySetting(self._settings, _STEPPER_MAX_ACCELERATION, 10, 10000)
-
+        self._settings['logging']       = MySetting(self._settings, 'logging', _LOGGING, False, True)
+        self._settings['width']         = MySetting(self._settings, 'width', _WIDTH_DEFAULT,  10, 100000)
+        self._settings['height']        = MySetting(self._settings, 'height', _HEIGHT_DEFAULT, 10, 100000)
+        self._settings['XRange']        = MySetting(self._settings, 'XRange', _XRANGE_DEFAULT, 10, 100000)
+        self._settings['YRange']        = MySetting(self._settings, 'YRange', _YRANGE_DEFAULT, 10, 100000)
+        self._settings['min_speed']     = MySetting(self._settings, 'min_speed', _STEPPER_MIN_SPEED, 10, 10000)
+        self._settings['max_speed']     = MySetting(self._settings, 'max_speed', _STEPPER_MAX_SPEED, 10, 100000)
+        self._settings['acceleration']  = MySetting(self._settings, 'acceleration', _STEPPER_MAX_ACCELERATION, 10, 10000)
+
+        # settings in a tuple so that the load and default loops do not walk the dict
+        self._settings_items = tuple(self._settings.values())
+        self._settings_menu_items = ["SAVE ALL", "DEFAULT ALL"] + list(self._settings)
+        # main menu items, without "XYStage" when there are no steppers to drive
+        self._main_menu_items_all = _main_menu_items.copy()
+        self._main_menu_items_no_stage = _main_menu_items[1:]
+        self._log: bool = _LOGGING      # cached copy of the 'logging' setting, see _apply_settings()
         self._edit_setting: int  = None
         self._edit_setting_value = None       
         self.update_settings()   
@@ -119,7 +188,7 @@ class XYStageApp(app.App):
         try:
             ver = parse_version(ota.get_version())
             if ver is not None:
-                if self._settings['logging'].v:
+                if self._log:
                     print(f"XYStage V{ver}")
                 # Potential to do things differently based on badge s/w version
                 # e.g. if ver < [1, 9, 0]:
@@ -132,10 +201,13 @@ class XYStageApp(app.App):
                                 HexDriveType(0xCBCC, servos=4, name="4 Servo"), 
                                 HexDriveType(0xCBCD, motors=1, servos=2, name="1 Mot 2 Srvo"),
                                 HexDriveType(0xCBCE, steppers=1, name="Stepper")]  
+        # (vid, pid) -> index into _HEXDRIVE_TYPES
+        self._hexdrive_type_index = {(t.vid, t.pid): index for index, t in enumerate(self._HEXDRIVE_TYPES)}
         self.hexpansion_slot_type = [None]*6
         self.hexdrive_port: int = None
-        self.ports_with_hexdrive = set()
+        self.ports_with_hexdrive: int = 0   # bitmask, bit n set when a HexDrive is on port n
         self.hexdrive_app = None
+        self._hexdrive_app_cache = {}   # port -> HexDriveApp found by find_hexdrive_app()
         eventbus.on_async(HexpansionInsertionEvent, self._handle_hexpansion_insertion, self)
         eventbus.on_async(HexpansionRemovalEvent, self._handle_hexpansion_removal, self)
 
@@ -144,19 +216,17 @@ class XYStageApp(app.App):
         self.num_steppers: int = 2       # Default assumed for dedicated hardware
         self._stepperX: Stepper = None
         self._stepperY: Stepper = None
-        self.xystage = {}
-        self.xystage['x'] = 0
-        self.xystage['y'] = 0
+        self._xy_x: int = 0             # current stage position relative to the centre
+        self._xy_y: int = 0
         self._keep_alive_period: int = 500                     # ms (half the value used in hexdrive.py)  
         self._timeout_period: int = 60*60000                   # ms (60 minutes)        
 
         # Overall app state (controls what is displayed and what user inputs are accepted)
         self.current_state = STATE_INIT
         self.previous_state = self.current_state
-        self._target = {}
-        self._target['x'] = 0
-        self._target['y'] = 0   
-        if self._settings['logging'].v:
+        self._target_x: int = 0         # position the stage returns to on CONFIRM
+        self._target_y: int = 0
+        if self._log:
             print("XYStageApp:Init")
 
 
@@ -164,8 +234,8 @@ class XYStageApp(app.App):
 
     async def _handle_hexpansion_removal(self, event: HexpansionRemovalEvent):
         self.hexpansion_slot_type[event.port-1] = None
-        if event.port in self.ports_with_hexdrive:
-            self.ports_with_hexdrive.remove(event.port)
+        self.ports_with_hexdrive &= ~(1 << event.port)
+        self._hexdrive_app_cache.pop(event.port, None)
         if event.port == self.hexdrive_port:
             self.hexdrive_port = None
             self.hexdrive_app = None
@@ -173,19 +243,37 @@ class XYStageApp(app.App):
             self.notification = Notification("HexDrive Removed")
 
     async def _handle_hexpansion_insertion(self, event: HexpansionInsertionEvent):
-        if self.check_port_for_hexdrive(event.port):
-            pass
+        if self.ports_with_hexdrive & (1 << event.port):
+            # already known (e.g. duplicate event) - no need to read the header again
+            return
+        self.check_port_for_hexdrive(event.port)
+        if self.ports_with_hexdrive & (1 << event.port):
+            # prime the app cache now, if the HexDrive app is not running yet find_hexdrive_app() will look again later
+            self.find_hexdrive_app(event.port)
+
     ### HEXPANSION FUNCTIONS ###
 
     # Scan the Hexpansion ports for EEPROMs and HexDrives in case they are already plugged in when we start
-    def scan_ports(self):
-        for port in range(1, 7):
+    # this yields between ports so that the UI is not held up waiting for the I2C transactions
+    async def _scan_ports_async(self):
+        for port in _VALID_PORTS:
+            if self.ports_with_hexdrive & (1 << port):
+                # already found via a HexpansionInsertionEvent - no need to read the header again
+                continue
             self.check_port_for_hexdrive(port)
+            await asyncio.sleep(0)
+        if self.ports_with_hexdrive and self.hexdrive_port is None:
+            # We have a HexDrive - remember which port it is on (the lowest numbered one)
+            for port in _VALID_PORTS:
+                if self.ports_with_hexdrive & (1 << port):
+                    self.hexdrive_port = port
+                    break
+            self.hexdrive_app = self.find_hexdrive_app(self.hexdrive_port)
 
 
     def check_port_for_hexdrive(self, port: int) -> bool:
         # we know the EEPROM address so we can just read the header directly
-        if port not in range(1, 7):
+        if port not in _VALID_PORTS:
             return False
         # We want to do this in two parts so that we detect if there is a valid EEPROM or not
         try:
@@ -195,59 +283,75 @@ class XYStageApp(app.App):
             return False
         except RuntimeError:
             # not a valid header
-            if self._settings['logging'].v:
+            if self._log:
                 print(f"H:Found EEPROM on port {port}")
             return True
-        # check is this is a HexDrive header by scanning the _HEXDRIVE_TYPES list
-        for index, hexpansion_type in enumerate(self._HEXDRIVE_TYPES):
-            if hexpansion_header.vid == hexpansion_type.vid and hexpansion_header.pid == hexpansion_type.pid:
-                if self._settings['logging'].v:
-                    print(f"H:Found '{hexpansion_type.name}' HexDrive on port {port}")
-                if port not in self.ports_with_hexdrive:
-                    self.ports_with_hexdrive.add(port)
-                self.hexpansion_slot_type[port-1] = index
-                return True
-        # we are not interested in this type of hexpansion
-        return False
+        # check is this is a HexDrive header by looking up its vid/pid
+        index = self._hexdrive_type_index.get((hexpansion_header.vid, hexpansion_header.pid))
+        if index is None:
+            # we are not interested in this type of hexpansion
+            return False
+        if self._log:
+            print(f"H:Found '{self._HEXDRIVE_TYPES[index].name}' HexDrive on port {port}")
+        self.ports_with_hexdrive |= (1 << port)
+        self.hexpansion_slot_type[port-1] = index
+        return True
 
 
-    def find_hexdrive_app(self, port: int) -> app:                    
+    def find_hexdrive_app(self, port: int) -> app:
+        an_app = self._hexdrive_app_cache.get(port)
+        if an_app is not None:
+            return an_app
         for an_app in scheduler.apps:
-            if type(an_app).__name__ is 'HexDriveApp':
+            if type(an_app).__name__ == 'HexDriveApp':
                 if hasattr(an_app, "config") and hasattr(an_app.config, "port") and  an_app.config.port == port:
+                    self._hexdrive_app_cache[port] = an_app
                     return an_app
         return None
 
 
     def update_settings(self):
-        for s in self._settings:
-            self._settings[s].v = settings.get(f"xystage.{s}", self._settings[s].d)
+        for setting in self._settings_items:
+            setting.v = settings.get(setting.key, setting.d)
+        self._apply_settings()
+
+
+    # refresh values derived from the settings - call whenever a setting value changes
+    def _apply_settings(self):
+        self._log = self._settings['logging'].v
+        self._min_speed = self._settings['min_speed'].v
+        self._max_speed = self._settings['max_speed'].v
+        self._x_centre = self._settings['XRange'].v//2
+        self._y_centre = self._settings['YRange'].v//2
+        # stage steps spanned by the screen area, used by _scale_xystage()
+        self._x_span = self._settings['XRange'].v + self._settings['width'].v
+        self._y_span = self._settings['YRange'].v + self._settings['height'].v
+        self._stage_size = self._scale_xystage(self._settings['width'].v, self._settings['height'].v)
 
 
     ### MAIN APP CONTROL FUNCTIONS ###
 
     def update(self, delta: int):
+        if _log_buffer:
+            print("\n".join(_log_buffer))
+            _log_buffer.clear()
+
         if self.notification:
             self.notification.update(delta)
+            if self.notification._is_closed():
+                # redraw whatever the notification was covering
+                self.notification = None
+                self._refresh = True
 
         if self.current_state == STATE_INIT:
-            # One Time initialisation
-            self.scan_ports()
-            if (len(self.ports_with_hexdrive) == 0):
-                # There are currently no possible HexDrives plugged in
-                self.current_state = STATE_WARNING
-            else:
-                # We have a HexDrive so we can start the main app
-                # remember which port it is on
-                self.hexdrive_port = list(self.ports_with_hexdrive)[0]
-                self.hexdrive_app = self.find_hexdrive_app(self.hexdrive_port)
-                self.current_state = STATE_MENU
+            # One Time initialisation - scan ports in the background so the menu can be drawn straight away
+            asyncio.create_task(self._scan_ports_async())
             self.current_state = STATE_MENU # NO HEXDRIVE REQUIRED FOR XYSTAGE AT PRESENT
         
         self._update_main_application(delta)
 
         if self.current_state != self.previous_state:
-            if self._settings['logging'].v:
+            if self._log:
                 print(f"State: {self.previous_state} -> {self.current_state}")
             self.previous_state = self.current_state
             # something has changed - so worth redrawing
@@ -262,10 +366,10 @@ class XYStageApp(app.App):
             else:
                 self.menu.update(delta)    
                 if self.menu.is_animating != "none":
-                    if self._settings['logging'].v:
+                    if self._log:
                         print("Menu is animating")
                     self._refresh = True
-        elif self.button_states.get(BUTTON_TYPES["CANCEL"]) and self.current_state in _MINIMISE_VALID_STATES:
+        elif self.button_states.get(_BTN_CANCEL) and (_MINIMISE_VALID_STATES >> self.current_state) & 1:
             self.button_states.clear()
             self.minimise()
 
@@ -278,76 +382,56 @@ class XYStageApp(app.App):
             self._update_state_settings(delta)
     ### End of Update ###
 
+    # Sample all the buttons of interest once per frame, returning a bitmask of those held
+    def _get_buttons(self) -> int:
+        get = self.button_states.get
+        buttons = 0
+        bit = 1
+        for button in _BTN_ORDER:
+            if get(button):
+                buttons |= bit
+            bit <<= 1
+        return buttons
+
+
     # XY Stage Control
     def _update_state_xystage(self, delta: int):
-        self.xystage['x'] = self._stepperX.get_pos(delta) - self._settings['XRange'].v//2        
-        self.xystage['y'] = self._stepperY.get_pos(delta) - self._settings['YRange'].v//2        
+        buttons = self._get_buttons()
+        min_speed = self._min_speed
+        stepper_x = self._stepperX
+        stepper_y = self._stepperY
+        self._xy_x = stepper_x.get_pos(delta) - self._x_centre
+        self._xy_y = stepper_y.get_pos(delta) - self._y_centre
         # Left/Right to adjust position
         pressed = False
-        if self.button_states.get(BUTTON_TYPES["CONFIRM"]):
+        if buttons & _MASK_CONFIRM:
             # if CONFIRM pressed then go to position 0,0
             pressed = True
             # if current position is not close to 0,0 then go to 0,0
             # check each of X & Y independently
-            # if value is too high then apply -ve speed
-            # if value is too low then apply +ve speed
-            # subject to the min and max speed limits
-            if self.xystage['x'] > (self._target['x'] + POSITION_MATCH_TOLERANCE):
-                self._stepperX.speed(-self._stepperX.get_speed_from_disance((self._target['x']-self.xystage['x'])))
-            elif self.xystage['x'] < (self._target['x'] - POSITION_MATCH_TOLERANCE):
-                self._stepperX.speed(self._stepperX.get_speed_from_disance((self._target['x']-self.xystage['x'])))
-            else:
-                self._stepperX.speed(0)
-            if self.xystage['y'] > (self._target['y'] + POSITION_MATCH_TOLERANCE):
-                self._stepperY.speed(-self._stepperY.get_speed_from_disance((self._target['y']-self.xystage['y'])))
-            elif self.xystage['y'] < (self._target['y'] - POSITION_MATCH_TOLERANCE):
-                self._stepperY.speed(self._stepperY.get_speed_from_disance((self._target['y']-self.xystage['y'])))
-            else:
-                self._stepperY.speed(0)
+            self._goto_target(stepper_x, self._target_x - self._xy_x)
+            self._goto_target(stepper_y, self._target_y - self._xy_y)
             self._refresh = True
         else:
-            if self.button_states.get(BUTTON_TYPES["RIGHT"]):
-                pressed = True
-                if self._auto_repeat_check(delta, False):
-                    speed = abs(self._stepperX.get_speed())
-                    # estimate the amount of movement based on the speed and time since last update         
-                    speed = max(self._settings['min_speed'].v, self._inc(speed, 1 + self._auto_repeat_level))
-                    self._stepperX.speed(speed)              
+            # Arrow buttons jog each axis: (stepper, +ve direction button, -ve direction button)
+            for stepper, forward, backward in ((stepper_x, _MASK_RIGHT, _MASK_LEFT), (stepper_y, _MASK_UP, _MASK_DOWN)):
+                if buttons & (forward | backward):
+                    pressed = True
+                    if self._auto_repeat_check(delta, False):
+                        speed = max(min_speed, self._inc(abs(stepper.get_speed()), 1 + self._auto_repeat_level, self._max_speed))
+                        stepper.speed(speed if buttons & forward else -speed)
+                        self._refresh = True
+                elif stepper.speed(0):
                     self._refresh = True
-            elif self.button_states.get(BUTTON_TYPES["LEFT"]):
-                pressed = True
-                if self._auto_repeat_check(delta, False):
-                    speed = abs(self._stepperX.get_speed())            
-                    speed = max(self._settings['min_speed'].v, self._inc(speed, 1 + self._auto_repeat_level))
-                    self._stepperX.speed(-speed)
-                    self._refresh = True
-            elif self._stepperX.speed(0):
-                self._refresh = True
-            if self.button_states.get(BUTTON_TYPES["UP"]):
-                pressed = True
-                if self._auto_repeat_check(delta, False):
-                    speed = abs(self._stepperY.get_speed())            
-                    speed = max(self._settings['min_speed'].v, self._inc(speed, 1 + self._auto_repeat_level))
-                    self._stepperY.speed(speed)
-                    self._refresh = True
-            elif self.button_states.get(BUTTON_TYPES["DOWN"]):
-                pressed = True
-                if self._auto_repeat_check(delta, False):
-                    speed = abs(self._stepperY.get_speed())            
-                    speed = max(self._settings['min_speed'].v, self._inc(speed, 1 + self._auto_repeat_level))
-                    self._stepperY.speed(-speed)
-                    self._refresh = True
-            elif self._stepperY.speed(0):
-                self._refresh = True    
         if pressed:
             self._time_since_last_input = 0
         else:
             self._auto_repeat_clear()
             # non auto-repeating buttons
-            if self.button_states.get(BUTTON_TYPES["CANCEL"]):
+            if buttons & _MASK_CANCEL:
                 self.button_states.clear()
-                self._stepperX.enable(False)
-                self._stepperY.enable(False)
+                stepper_x.enable(False)
+                stepper_y.enable(False)
                 self.current_state = STATE_MENU
                 return            
             if self._refresh or self._time_since_last_input == 0:
@@ -356,68 +440,77 @@ class XYStageApp(app.App):
             else:
                 self._time_since_last_input += delta                
                 if self._time_since_last_input > self._timeout_period:
-                    self._stepperX.stop()
-                    self._stepperX.speed(0)
-                    self._stepperX.enable(False)
-                    self._stepperY.stop()
-                    self._stepperY.speed(0)
-                    self._stepperY.enable(False)                
+                    stepper_x.halt()
+                    stepper_y.halt()
                     self.current_state = STATE_MENU
                     self.notification = Notification("  Stepper:\n Timeout")
-                    if self._settings['logging'].v:
+                    if self._log:
                         print("Stepper:Timeout")          
 
-        if self._refresh and self._settings['logging'].v:               
-            print(f"X:{self.xystage['x']} Y:{self.xystage['y']}")
+        if self._refresh and self._log:               
+            print(f"X:{self._xy_x} Y:{self._xy_y}")
+
+
+    # Drive a stepper towards its target, the sign of the distance gives the direction
+    # subject to the min and max speed limits
+    def _goto_target(self, stepper, distance: int):
+        if -POSITION_MATCH_TOLERANCE <= distance <= POSITION_MATCH_TOLERANCE:
+            stepper.speed(0)
+        else:
+            speed = stepper.get_speed_from_disance(distance)
+            stepper.speed(speed if distance > 0 else -speed)
 
 
-    def _update_state_settings(self, delta: int):    
-        if self.button_states.get(BUTTON_TYPES["UP"]):
+    def _update_state_settings(self, delta: int):
+        buttons = self._get_buttons()
+        if buttons & _MASK_UP:
             if self._auto_repeat_check(delta, False):
                 self._edit_setting_value = self._settings[self._edit_setting].inc(self._edit_setting_value, self._auto_repeat_level)
-                if self._settings['logging'].v:
+                if self._log:
                     print(f"Setting: {self._edit_setting} (+) Value: {self._edit_setting_value}")
                 self._refresh = True
-        elif self.button_states.get(BUTTON_TYPES["DOWN"]):
+        elif buttons & _MASK_DOWN:
             if self._auto_repeat_check(delta, False):
                 self._edit_setting_value = self._settings[self._edit_setting].dec(self._edit_setting_value, self._auto_repeat_level)  
-                if self._settings['logging'].v:
+                if self._log:
                     print(f"Setting: {self._edit_setting} (-) Value: {self._edit_setting_value}")
                 self._refresh = True            
         else:
             # non auto-repeating buttons
             self._auto_repeat_clear()                           
-            if self.button_states.get(BUTTON_TYPES["RIGHT"]) or self.button_states.get(BUTTON_TYPES["LEFT"]):
+            if buttons & (_MASK_RIGHT | _MASK_LEFT):
                 self.button_states.clear() 
                 # Force default value    
                 self._edit_setting_value = self._settings[self._edit_setting].d
-                if self._settings['logging'].v:
+                if self._log:
                     print(f"Setting: {self._edit_setting} Default: {self._edit_setting_value}")
                 self._refresh = True
                 self.notification = Notification("Default")
-            elif self.button_states.get(BUTTON_TYPES["CANCEL"]):
+            elif buttons & _MASK_CANCEL:
                 self.button_states.clear()
                 # leave setting unchanged
-                if self._settings['logging'].v:
+                if self._log:
                     print(f"Setting: {self._edit_setting} Cancelled")
                 self.set_menu(_main_menu_items[3])
                 self.current_state = STATE_MENU
-            elif self.button_states.get(BUTTON_TYPES["CONFIRM"]):
+            elif buttons & _MASK_CONFIRM:
                 self.button_states.clear()
                 # set setting
-                if self._settings['logging'].v:
+                if self._log:
                     print(f"Setting: {self._edit_setting} = {self._edit_setting_value}")
                 self._settings[self._edit_setting].v = self._edit_setting_value
                 self._settings[self._edit_setting].persist()
+                self._apply_settings()
                 self.notification = Notification(f"  Setting:   {self._edit_setting}={self._edit_setting_value}")
                 self.set_menu(_main_menu_items[3])
                 self.current_state = STATE_MENU
 
 
     def draw(self, ctx):
-        if self._refresh or self.notification is not None:
+        refresh = self._refresh or self.notification is not None
+        if refresh and self.current_state != STATE_MENU:
             self._refresh = False
-            clear_background(ctx)   
+            # no clear_background() here, the black fill below covers the whole screen
             ctx.save()
             ctx.font_size = label_font_size
             if ctx.text_align != ctx.LEFT:
@@ -427,7 +520,7 @@ class XYStageApp(app.App):
             ctx.rgb(0,0,0).rectangle(-120,-120,240,240).fill()
             # Main screen content 
             if   self.current_state == STATE_WARNING:
-                self.draw_message(ctx, ["XYStage requires","HexDrive hexpansion","from RobotMad","github.com","/TeamRobotmad","/XYStage"], [(1,1,1),(1,1,0),(1,1,0),(1,1,1),(1,1,1),(1,1,1)], label_font_size)
+                self.draw_message(ctx, _WARNING_MESSAGE, _WARNING_COLOURS, label_font_size)
             elif self.current_state == STATE_ERROR:
                 self.draw_message(ctx, self.error_message, [(1,0,0)]*len(self.error_message), label_font_size)
             elif self.current_state == STATE_MESSAGE:
@@ -435,12 +528,13 @@ class XYStageApp(app.App):
             elif self.current_state == STATE_XYSTAGE:
                 self._draw_state_xystage(ctx)                
             elif self.current_state == STATE_SETTINGS:
-                self.draw_message(ctx, ["Edit Setting",f"{self._edit_setting}:",f"{self._edit_setting_value}"], [(1,1,1),(0,0,1),(0,1,0)], label_font_size)
+                self.draw_message(ctx, ["Edit Setting",f"{self._edit_setting}:",f"{self._edit_setting_value}"], _SETTINGS_COLOURS, label_font_size)
                 button_labels(ctx, up_label="+", down_label="-", confirm_label="Set", cancel_label="Cancel", right_label="Default")
             ctx.restore()
 
-        # These need to be drawn every frame as they contain animations
-        if self.current_state == STATE_MENU:
+        # The menu contains animations so needs redrawing while it is animating, as well as when anything has changed
+        if self.current_state == STATE_MENU and (refresh or self.menu.is_animating != "none"):
+            self._refresh = False
             clear_background(ctx)               
             self.menu.draw(ctx)
 
@@ -452,29 +546,33 @@ class XYStageApp(app.App):
         # Draw outer rectangle for the XYStage based on the largest that can fit on the screen
         # top left of the rectangle is at -100,-100 i.e. Y is inverted
         ctx.rgb(0.3,0.3,0.3).rectangle(-_USABLE_X_PIXELS//2,-_USABLE_Y_PIXELS//2,_USABLE_X_PIXELS,_USABLE_Y_PIXELS).stroke()
-        x,y   = self._scale_xystage(self.xystage['x'],-self.xystage['y'])
-        sx,sy = self._scale_xystage(self._settings['width'].v,self._settings['height'].v)
+        x,y   = self._scale_xystage(self._xy_x,-self._xy_y)
+        sx,sy = self._stage_size
         ctx.rgb(0.0,1.0,0.2).rectangle(x-(sx//2),y-(sy//2),sx,sy).fill()        
-        # Draw a small black cross hair at the 'x','y' position
-        ctx.rgb(0,0,0).move_to(x-10,y).line_to(x+10,y).stroke()
-        ctx.rgb(0,0,0).move_to(x,y-10).line_to(x,y+10).stroke()
+        # Draw a small black cross hair at the 'x','y' position - both lines as one path
+        ctx.rgb(0,0,0).move_to(x-10,y).line_to(x+10,y).move_to(x,y-10).line_to(x,y+10).stroke()
         # Display the x,y position of the stage in text underneath the stage
-        ctx.rgb(1,1,1).move_to(-70, 100).text(f"{self.xystage['x']//32:5d}, {self.xystage['y']//32:5d}")
+        ctx.rgb(1,1,1).move_to(-70, 100).text(f"{self._xy_x//32:5d}, {self._xy_y//32:5d}")
         #button_labels(ctx, confirm_label="Stop", cancel_label="Exit", left_label="<--", right_label="-->")
 
     def _scale_xystage(self, x: int, y: int) -> (int, int):
         # scale x,y to the canvas range:
         # x,y are in the range -'XRange'/2 to 'XRange'/2 and -'YRange'/2 to 'YRange'/2
-        x = int(_USABLE_X_PIXELS*x/(self._settings['XRange'].v + self._settings['width'].v))
-        y = int(_USABLE_Y_PIXELS*y/(self._settings['YRange'].v + self._settings['height'].v))
-        return x, y
+        # using the spans precomputed in _apply_settings() and integer maths
+        # scale the magnitude so that, like int(), the result rounds towards zero on both sides of the centre
+        sx = -((-x * _USABLE_X_PIXELS) // self._x_span) if x < 0 else (x * _USABLE_X_PIXELS) // self._x_span
+        sy = -((-y * _USABLE_Y_PIXELS) // self._y_span) if y < 0 else (y * _USABLE_Y_PIXELS) // self._y_span
+        return sx, sy
 
     # Value increment/decrement functions for positive integers only
-    def _inc(self, v: int, l: int):
+    # if a cap is given and already reached then there is no need to work out the increment
+    def _inc(self, v: int, l: int, cap: int = None):
+        if cap is not None and v >= cap:
+            return cap
         if l==0:
             return v+1
         else:
-            d = 10**l
+            d = _POW10[l]
             v = ((v // d) + 1) * d   # round up to the next multiple of 10^l
             return v
     
@@ -482,34 +580,46 @@ class XYStageApp(app.App):
         if l==0:
             return v-1
         else:
-            d = 10**l
-            v = (((v+(9*(10**(l-1)))) // d) - 1) * d   # round down to the next multiple of 10^l
+            d = _POW10[l]
+            v = (((v+(9*_POW10[l-1])) // d) - 1) * d   # round down to the next multiple of 10^l
             return v
 
 
     def draw_message(self, ctx, message, colours, size=label_font_size):
         ctx.font_size = size
         num_lines = len(message)
+        y_positions = self._y_position_cache.get((num_lines, size))
+        if y_positions is None:
+            # Font is not central in the height allocated to it due to space for descenders etc...
+            # this is most obvious when there is only one line of text
+            # # position fine tuned to fit around button labels when showing 5 lines of text
+            if num_lines == 1:
+                y_positions = (int(0.35 * size),)
+            else:
+                y_positions = tuple(int((i_num-((num_lines-2)/2)) * size - 2) for i_num in range(num_lines))
+            self._y_position_cache[(num_lines, size)] = y_positions
         for i_num, instr in enumerate(message):
             text_line = str(instr)
-            width = ctx.text_width(text_line)
+            width = self._text_width_cache.get((size, text_line))
+            if width is None:
+                if len(self._text_width_cache) >= _TEXT_WIDTH_CACHE_MAX:
+                    # e.g. setting values being edited - don't let the cache grow without bound
+                    self._text_width_cache.clear()
+                width = ctx.text_width(text_line)
+                self._text_width_cache[(size, text_line)] = width
             try:
                 colour = colours[i_num]
             except IndexError:
                 colour = None
             if colour is None:
                 colour = (1,1,1)
-            # Font is not central in the height allocated to it due to space for descenders etc...
-            # this is most obvious when there is only one line of text
-            # # position fine tuned to fit around button labels when showing 5 lines of text        
-            y_position = int(0.35 * ctx.font_size) if num_lines == 1 else int((i_num-((num_lines-2)/2)) * ctx.font_size - 2)
-            ctx.rgb(*colour).move_to(-width//2, y_position).text(text_line)
+            ctx.rgb(*colour).move_to(-width//2, y_positions[i_num]).text(text_line)
 
 ### MENU FUNCTIONALITY ###
 
 
     def set_menu(self, menu_name = "main"):  #: Literal["main"]): does it work without the type hint?
-        if self._settings['logging'].v:
+        if self._log:
             print(f"H:Set Menu {menu_name}")
         if self.menu is not None:
             try:
@@ -520,25 +630,20 @@ class XYStageApp(app.App):
                 # and then access to this function is removed
                 pass
         self.current_menu = menu_name
+        self._refresh = True
         if menu_name == "main":
-            # construct the main menu based on template
-            menu_items = _main_menu_items.copy()
-            if self.num_steppers == 0:
-                menu_items.remove(_main_menu_items[0])   
+            # construct the main menu from the cached item lists
             self.menu = Menu(
                     self,
-                    menu_items,
+                    self._main_menu_items_all if self.num_steppers else self._main_menu_items_no_stage,
                     select_handler=self._main_menu_select_handler,
                     back_handler=self._menu_back_handler,
                 )            
         elif menu_name == "Settings":
             # construct the settings menu
-            _settings_menu_items = ["SAVE ALL", "DEFAULT ALL"]
-            for _, setting in enumerate(self._settings):
-                _settings_menu_items.append(f"{setting}")
             self.menu = Menu(
                 self,
-                _settings_menu_items,
+                self._settings_menu_items,
                 select_handler=self._settings_menu_select_handler,
                 back_handler=self._menu_back_handler,
                 )
@@ -546,12 +651,12 @@ class XYStageApp(app.App):
 
     # this appears to be able to be called at any time
     def _main_menu_select_handler(self, item: str, idx: int):
-        if self._settings['logging'].v:
+        if self._log:
             print(f"H:Main Menu {item} at index {idx}")
         if item == _main_menu_items[0]: # XYStage
             if self.num_steppers == 0:
                 self.notification = Notification("Hexpansion Missing")
-                if self._settings['logging'].v:
+                if self._log:
                     print("No Hexpansion")
             else:
                 if self._stepperX is None or self._stepperY is None:
@@ -566,7 +671,7 @@ class XYStageApp(app.App):
                                 pins["step"] = self._hexpansion_config.pin[X_STEP]
                                 pins["stop"] = self._hexpansion_config.pin[X_ENDSTOP]
                                 self._stepperX = Stepper(self, pins, initial_pos = self._settings['XRange'].v//2, reverse = True, name = "X", max_sps = self._settings['max_speed'].v, max_pos=self._settings['XRange'].v, max_sps_change = self._settings['acceleration'].v)
-                                if self._settings['logging'].v:
+                                if self._log:
                                     print(f"StepperX:Init {i}")
                                 continue
                             except Exception as e:
@@ -581,7 +686,7 @@ class XYStageApp(app.App):
                                 pins["step"] = self._hexpansion_config.pin[Y_STEP]
                                 pins["stop"] = self._hexpansion_config.pin[Y_ENDSTOP]                                
                                 self._stepperY = Stepper(self, pins, initial_pos = self._settings['YRange'].v//2, name = "Y", max_sps = self._settings['max_speed'].v, max_pos=self._settings['YRange'].v, max_sps_change = self._settings['acceleration'].v)
-                                if self._settings['logging'].v:
+                                if self._log:
                                     print(f"StepperY:Init {i}")
                                 # Start off assuming stage is in last known position
                                 continue
@@ -615,20 +720,23 @@ class XYStageApp(app.App):
             eventbus.emit(RequestStopAppEvent(self))
 
     def _settings_menu_select_handler(self, item: str, idx: int):
-        if self._settings['logging'].v:
+        if self._log:
             print(f"H:Setting {item} @ {idx}")
         if idx == 0: #Save
-            if self._settings['logging'].v:
+            if self._log:
                 print("H:Settings Save All")
             settings.save()
             self.notification = Notification("  Settings  Saved")
             self.set_menu("main")
         elif idx == 1: #Default
-            if self._settings['logging'].v:
+            if self._log:
                 print("H:Settings Default All")
-            for s in self._settings:
-                self._settings[s].v = self._settings[s].d
-                self._settings[s].persist()
+            for setting in self._settings_items:
+                # settings already at their default have nothing stored to clear
+                if setting.v != setting.d:
+                    setting.v = setting.d
+                    setting.persist()
+            self._apply_settings()
             self.notification = Notification("  Settings Defaulted")
 
             self.set_menu("main")
@@ -652,18 +760,23 @@ class XYStageApp(app.App):
     # multi level auto repeat
     # if speed_up is True, the auto repeat gets faster the longer the button is held
     # otherwise it is a fixed rate, but the level is used to determine the scale of the increase in the setttings inc() and dec() functions
+    @micropython.native
     def _auto_repeat_check(self, delta: int, speed_up: bool = True) -> bool:                
         self._auto_repeat += delta
+        if speed_up:
+            interval, threshold = self._cur_interval_fast, self._cur_thres_fast
+        else:
+            interval, threshold = _AUTO_REPEAT_INTERVALS[0], _AUTO_REPEAT_COUNT_THRESHOLDS[0]
         # multi stage auto repeat - the repeat gets faster the longer the button is held
-        if self._auto_repeat > self._auto_repeat_intervals[self._auto_repeat_level if speed_up else 0]:
+        if self._auto_repeat > interval:
             self._auto_repeat = 0
             self._auto_repeat_count += 1
             # variable threshold to count to increase level so that it is not too easy to get to the highest level as the auto repeat period is reduced
-            if self._auto_repeat_count > ((_AUTO_REPEAT_COUNT_THRES*_AUTO_REPEAT_MS) // self._auto_repeat_intervals[self._auto_repeat_level if speed_up else 0]):
+            if self._auto_repeat_count > threshold:
                 self._auto_repeat_count = 0
                 if self._auto_repeat_level < (_AUTO_REPEAT_SPEED_LEVEL_MAX if speed_up else _AUTO_REPEAT_LEVEL_MAX):
-                    self._auto_repeat_level += 1
-                    if self._settings['logging'].v:
+                    self._set_auto_repeat_level(self._auto_repeat_level + 1)
+                    if self._log:
                         print(f"Auto Repeat Level: {self._auto_repeat_level}")
 
             return True
@@ -671,10 +784,17 @@ class XYStageApp(app.App):
 
 
     def _auto_repeat_clear(self):                
-        self._auto_repeat = 1+ self._auto_repeat_intervals[0] # so that we trigger immediately on next press 
+        self._auto_repeat = 1+ _AUTO_REPEAT_INTERVALS[0] # so that we trigger immediately on next press 
 
         self._auto_repeat_count = 0 
-        self._auto_repeat_level = 0
+        self._set_auto_repeat_level(0)
+
+
+    # change the auto repeat level, updating the cached speed up interval and threshold to match
+    def _set_auto_repeat_level(self, level: int):
+        self._auto_repeat_level = level
+        self._cur_interval_fast = _AUTO_REPEAT_INTERVALS[level]
+        self._cur_thres_fast = _AUTO_REPEAT_COUNT_THRESHOLDS[level]
 
 
 
@@ -696,30 +816,37 @@ class Stepper:  # External Driver DRV8825
             self._max_sps = int(max_sps)                # max speed in steps per second
             self._max_pos = int(max_pos)                # max position stored in steps        
             self._steps_per_sec = 0                     # current speed in steps per second
+            self._abs_sps = 0                           # magnitude of the current speed
             self._calibrated = False
             self._timer_mode = 0
             self._pos = initial_pos                     # current position in steps
             self._free_run_mode = 1                     # direction of free run mode
             self._enabled = False
+            self._endstop_flag = False                  # endstop edge seen, waiting for _sample_endstop() to confirm it
+            self._endstop_count = 0                     # consecutive closed samples of the endstop
             self._freq = 0
             self._updates_per_sec = 10
 
             # Pins for external stepper driver
-            self._pins = pins
-            self._pins["en"].init(mode=Pin.OUT)
-            self._pins["en"].on()   # active low
-            self._pins["dir"].init(mode=Pin.OUT)
-            self._pins["dir"].off()
-            self._pins["step"].init(mode=Pin.OUT)
-            self._pins["step"].off()
-            self._pins["stop"].init(mode=Pin.IN, pull=Pin.PULL_UP)
-            self._pins["stop"].irq(trigger=Pin.IRQ_FALLING, handler=self._hit_endstop)
+            # hold each pin in its own attribute, saves a dict lookup on every use
+            self._p_en   = pins["en"]
+            self._p_dir  = pins["dir"]
+            self._p_step = pins["step"]
+            self._p_stop = pins["stop"]
+            self._p_en.init(mode=Pin.OUT)
+            self._p_en.on()   # active low
+            self._p_dir.init(mode=Pin.OUT)
+            self._p_dir.off()
+            self._p_step.init(mode=Pin.OUT)
+            self._p_step.off()
+            self._p_stop.init(mode=Pin.IN, pull=Pin.PULL_UP)
+            self._p_stop.irq(trigger=Pin.IRQ_FALLING, handler=self._hit_endstop)
         except Exception as e:
             print(f"{self._name} Init failed:{e}")
 
         # Setup PWM output on the step pin
         try:
-            self._pwm = PWM(self._pins["step"], freq=10, duty_ns=0)    # 0 Hz is invalid but 0 duty is allowed
+            self._pwm = PWM(self._p_step, freq=10, duty_ns=0)    # 0 Hz is invalid but 0 duty is allowed
         except Exception as e:
             print(f"{self._name} PWM failed:{e}")
   
@@ -732,11 +859,12 @@ class Stepper:  # External Driver DRV8825
         # calculate stopping distance at current speed
         # s = 0.5 * (u^2) / a
         steps_to_stop = int((self._steps_per_sec ** 2) / (2 * (self._max_sps_change * self._updates_per_sec)))
-        print(f"{self._name}:{time.ticks_ms():6d}:Steps to stop:{steps_to_stop}/{distance}")
+        if self._container._log:
+            _log_deferred(f"{self._name}:{time.ticks_ms():6d}:Steps to stop:{steps_to_stop}/{distance}")
         if abs(distance) <= (steps_to_stop + (self._steps_per_sec//self._updates_per_sec)):
             # if we are already close to the target, then stop
             # we can return min target speed as the speed control will enforce the max acceleration
-            return self._container._settings['min_speed'].v
+            return self._container._min_speed
         elif abs(distance) <= (steps_to_stop + ((self._steps_per_sec + 2*self._max_sps_change)//self._updates_per_sec)):
             # we can't affored to increase the speed as we will overshoot the target
             return self._steps_per_sec
@@ -749,68 +877,77 @@ class Stepper:  # External Driver DRV8825
             self._free_run_mode = -1
         elif self._free_run_mode == -1 and sps > 0:
             self._free_run_mode = 1
-        speed_change_limited = False                
+        if self._endstop_flag:
+            self._sample_endstop()
+        speed_change_limited = False
         if sps > 0:
-            if self._calibrated and self._pos >= self._max_pos:
-                # endstop reached
-                sps = 0    
-            else:
-                if sps > self._max_sps:
-                    # limit speed
-                    sps = self._max_sps
-                # limit acceleration by comparing the change in speed to the max acceleration
-                # if the change is greater than the max acceleration, limit the change to the max acceleration
-                if sps - self._steps_per_sec > self._max_sps_change:
-                    sps = self._steps_per_sec + self._max_sps_change
-                    speed_change_limited = True
-                elif sps - self._steps_per_sec < -self._max_sps_change:
-                    sps = self._steps_per_sec - self._max_sps_change
-                    speed_change_limited = True
+            endstop = self._calibrated and self._pos >= self._max_pos
         else:
-            if self._pins["stop"].value() == 0 or (self._calibrated and self._pos <= 0):
-                # endstop reached
-                sps = 0        
-            else:
-                if sps < -self._max_sps:
-                    # limit speed
-                    sps = -self._max_sps
-                # limit acceleration by comparing the change in speed to the max acceleration
-                # if the change is greater than the max acceleration, limit the change to the max acceleration
-                if sps - self._steps_per_sec > self._max_sps_change:
-                    sps = self._steps_per_sec + self._max_sps_change
-                    speed_change_limited = True
-                elif sps - self._steps_per_sec < -self._max_sps_change:
-                    sps = self._steps_per_sec - self._max_sps_change
-                    speed_change_limited = True
-        self._steps_per_sec = int(sps)
-        self._update_timer(abs(self._steps_per_sec))    # steps per second
+            endstop = self._p_stop.value() == 0 or (self._calibrated and self._pos <= 0)
+        if endstop:
+            # endstop reached
+            sps = 0
+        else:
+            # load the limits once, they are fixed after construction
+            max_sps = self._max_sps
+            max_change = self._max_sps_change
+            current = self._steps_per_sec
+            # limit speed
+            sps = max(-max_sps, min(max_sps, sps))
+            # limit acceleration by comparing the change in speed to the max acceleration
+            # if the change is greater than the max acceleration, limit the change to the max acceleration
+            change = sps - current
+            if change > max_change:
+                sps = current + max_change
+                speed_change_limited = True
+            elif change < -max_change:
+                sps = current - max_change
+                speed_change_limited = True
+        sps = int(sps)
+        if sps == self._steps_per_sec:
+            # nothing to change (e.g. holding at max speed or already stopped)
+            return speed_change_limited
+        self._steps_per_sec = sps
+        self._abs_sps = -sps if sps < 0 else sps
+        self._update_timer(self._abs_sps)    # steps per second
         return speed_change_limited
 
     def get_speed(self) -> int:
         return self._steps_per_sec
 
     # function to estimate the current position based on the speed and time since last update
+    @micropython.native
     def get_pos(self, delta) -> int:
-        steps = (self._steps_per_sec * delta) // 1000
-        self._pos += steps
-        # Check if we have hit the end stop
-        if self._calibrated:
-            if self._pos < 0 and self._steps_per_sec < 0:
-                if self._container._settings['logging'].v:
-                    print(f"{self._name} s/w min endstop")
-                self.speed(0)
-            elif self._pos > self._max_pos and self._steps_per_sec > 0:
-                if self._container._settings['logging'].v:
-                    print(f"{self._name} s/w max endstop")
-                self.speed(0)        
-        return self._pos 
+        if self._endstop_flag:
+            self._sample_endstop()
+        sps = self._steps_per_sec
+        pos = self._pos + (sps * delta) // 1000
+        self._pos = pos
+        # Check if we have hit the s/w end stop while still moving towards it
+        if self._calibrated and ((pos < 0 and sps < 0) or (pos > self._max_pos and sps > 0)):
+            if self._container._log:
+                _log_deferred(f"{self._name} s/w {'min' if sps < 0 else 'max'} endstop")
+            self.speed(0)
+        return pos
         
-    def _hit_endstop(self, pin: Pin):           
-        # double check the endstop is hit
-        # if not, ignore the interrupt
-        if pin.value() == 0:  
-            if self._container._settings['logging'].v:
-                print(f"{self._name} Endstop - hit")
+    # Pin IRQ handler - keep it short, the pin is sampled outside the interrupt by _sample_endstop()
+    def _hit_endstop(self, pin: Pin):
+        if self._endstop_flag:
+            # already pending - ignore further edges from switch bounce
+            return
+        self._endstop_count = 0
+        self._endstop_flag = True
+
+    # Called from get_pos() and speed() while an endstop edge is pending, taking one sample per call
+    # so that the reads are spread out in time and contact bounce is not taken as a hit
+    def _sample_endstop(self):
+        if self._p_stop.value() == 0:
+            self._endstop_count += 1
+            if self._endstop_count < _ENDSTOP_DEBOUNCE_SAMPLES:
+                return
+            self._endstop_flag = False
+            if self._container._log:
+                _log_deferred(f"{self._name} Endstop - hit")
             if not self._calibrated:
                 self._calibrated = True
                 self._pos = 0
@@ -818,50 +955,62 @@ class Stepper:  # External Driver DRV8825
             if self._steps_per_sec < 0:
                 self.speed(0)
         else:
-            print(f"{self._name} Endstop - false alarm")
+            self._endstop_flag = False
+            # re-read in case the switch closed again just before the flag was cleared, as that edge was ignored
+            if self._p_stop.value() == 0:
+                self._endstop_count = 0
+                self._endstop_flag = True
+            elif self._container._log:
+                _log_deferred(f"{self._name} Endstop - false alarm")
 
     def _update_timer(self,freq):
-        if freq == 0:
-            self._pins["en"].on()        # disable the stepper
-            self._pwm.duty_ns(0)        # stop the PWM (frequency of 0 is not allowed)
-            self._freq = 0   
-        elif freq != self._freq or self._free_run_mode != self._timer_mode:
-            try:                
-                if self._container._settings['logging'].v:
-                    print(f"{self._name} Timer:{self._free_run_mode} {freq}Hz")
-                if self._free_run_mode>0:
-                    self._pins["dir"].value(1 if self._reverse else 0)
-                    self._pwm.freq(int(freq))
-                    self._pwm.duty_ns(2000)     # minimum 1.9uS STEP pulse width for DRV8825                     
-                    self._pins["en"].off()    # enable active low
-                elif self._free_run_mode<0:
-                    self._pins["dir"].value(0 if self._reverse else 1)
-                    self._pwm.freq(int(freq))
-                    self._pwm.duty_ns(2000)     # minimum 1.9uS STEP pulse width for DRV8825                      
-                    self._pins["en"].off()    # enable active low
+        try:
+            if freq == 0:
+                self._p_en.on()        # disable the stepper
+                self._pwm.duty_ns(0)        # stop the PWM (frequency of 0 is not allowed)
+                self._freq = 0   
+            elif freq != self._freq or self._free_run_mode != self._timer_mode:
+                if self._container._log:
+                    _log_deferred(f"{self._name} Timer:{self._free_run_mode} {freq}Hz")
+                if self._freq != 0 and self._free_run_mode == self._timer_mode:
+                    # already stepping in this direction - only the rate has changed so leave DIR and EN alone
+                    self._pwm.freq(freq)
+                    self._pwm.duty_ns(2000)     # reassert the pulse width in case the port rescales duty with freq
+                elif self._free_run_mode != 0:
+                    # DIR pin level is the direction flipped by the reverse setting
+                    self._p_dir.value((self._free_run_mode > 0) == bool(self._reverse))
+                    self._pwm.freq(freq)
+                    self._pwm.duty_ns(2000)     # minimum 1.9uS STEP pulse width for DRV8825
+                    self._p_en.off()    # enable active low
                 else:
-                    self._pins["en"].on()
+                    self._p_en.on()
                     self._pwm.duty_ns(0)        # stop the PWM (frequency of 0 is not allowed)   
                 self._freq = freq
                 self._timer_mode = self._free_run_mode
-            except Exception as e:
-                print(f"{self._name} update_timer failed:{e}")
+        except Exception as e:
+            # e.g. the PWM could not be set up in __init__
+            print(f"{self._name} update_timer failed:{e}")
 
 
     def stop(self):
         self._update_timer(0)
 
+    # stop immediately (without deceleration) and disable the driver
+    def halt(self):
+        self._steps_per_sec = 0
+        self._abs_sps = 0
+        self._enabled = False
+        self._update_timer(0)
+
     def enable(self,e = True):
         self._enabled=e
-        self._pins["en"].value(not e)
-        try:
-            if e:
-                if self._free_run_mode!=0:
-                    self._update_timer(abs(self._steps_per_sec))   # steps per second                
-            else:
-                self._update_timer(0)
-        except Exception as e:
-            print(f"{self._name} enable failed:{e}")
+        self._p_en.value(not e)
+        # _update_timer() handles its own failures
+        if e:
+            if self._free_run_mode!=0:
+                self._update_timer(self._abs_sps)   # steps per second
+        else:
+            self._update_timer(0)
 
     def is_enabled(self) -> bool:
         return self._enabled
@@ -879,71 +1028,70 @@ class HexDriveType:
 
 
 class MySetting:
-    def __init__(self, container, default, minimum, maximum):
+    def __init__(self, container, key, default, minimum, maximum):
         self._container = container
+        self.key = "xystage." + key   # full settings store key, built once
         self.d = default
         self.v = default
         self._min = minimum
         self._max = maximum
+        # type of the setting, fixed by its default, so inc()/dec() don't need isinstance() on every call
+        t = type(default)
+        self._kind = _KIND_BOOL if t is bool else _KIND_INT if t is int else _KIND_FLOAT if t is float else _KIND_OTHER
 
 
     def __str__(self):
         return str(self.v)
 
 
-    def _index(self):
-        for k,v in self._container.items():
-            if v == self:
-                return k
-        return None
-
-        
     # This returns an increase in the value passed in - subject to max and with scale of increase depending on level
     # based on the type of the setting
     # it does not affect the current value of the setting
     def inc(self, v, l=0):            
-        if isinstance(self.v, bool):
+        kind = self._kind
+        if kind == _KIND_BOOL:
             v = not v
-        elif isinstance(self.v, int):
+        elif kind == _KIND_INT:
             if l==0:
                 v += 1
             else:
-                d = 10**l
+                d = _POW10[l]
                 v = ((v // d) + 1) * d   # round up to the next multiple of 10^l, being very careful not to cause big jumps when value was nearly at the next multiple 
 
             if v > self._max:
                 v = self._max
-        elif isinstance(self.v, float):
+        elif kind == _KIND_FLOAT:
             # only float at present is brightness from 0.0 to 1.0
             v += 0.1            
             if v > self._max:
                 v = self._max  
         elif self._container['logging'].v:
-            print(f"H:inc type: {type(self.v)}")                               
+            print(f"H:inc {self.key} type: {type(self.v)}")                               
         return v
 
     # This returns a decrease in the value passed in - subject to min and with scale of increase depending on level
     # based on the type of the setting
     # it does not affect the current value of the setting
     def dec(self, v, l=0):            
-        if isinstance(self.v, bool):
+        kind = self._kind
+        if kind == _KIND_BOOL:
             v = not v
-        elif isinstance(self.v, int):
+        elif kind == _KIND_INT:
             if l==0:
                 v -= 1
             else:
-                d = 10**l
-                v = (((v+(9*(10**(l-1)))) // d) - 1) * d   # round down to the next multiple of 10^l
+                d = _POW10[l]
+                v = (((v+(9*_POW10[l-1])) // d) - 1) * d   # round down to the next multiple of 10^l
 
             if v < self._min:
                 v = self._min       
-        elif isinstance(self.v, float):
+        elif kind == _KIND_FLOAT:
             # only float at present is brightness from 0.0 to 1.0
             v -= 0.1            
             if v < self._min:
                 v = self._min
         elif self._container['logging'].v:
-            print(f"H: dec type: {type(self.v)}") 
+            print(f"H: dec {self.key} type: {type(self.v)}") 
         return v
     
 
@@ -951,10 +1099,10 @@ class MySetting:
         # only save non-default settings to the settings store
         try:
             if self.v != self.d:
-                settings.set(f"xystage.{self._index()}", self.v)
+                settings.set(self.key, self.v)
             else:
-                settings.set(f"xystage.{self._index()}", None)
+                settings.set(self.key, None)
         except Exception as e:
-            print(f"H:Failed to persist setting {self._index()}: {e}")
+            print(f"H:Failed to persist setting {self.key}: {e}")
 
 __app_export__ = XYStageApp
@@ -44,7 +44,9 @@ if __name__ == "__main__":
 
     for file in files_to_mpy:
         print(f"Mpy-ing file: {file}")
-        mpy_cross.run(file, "-v")
+        # -O3 strips asserts and line number info to save space on the badge
+        # -march is needed for the @micropython.native functions, the badge is an ESP32-S3
+        mpy_cross.run(file, "-v", "-O3", "-march=xtensawin")
 
     if not files_to_keep.issubset(found_files):
         raise FileNotFoundError(f"Some of {files_to_keep} are not found so assuming wrong directory. "
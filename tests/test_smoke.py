@@ -21,3 +21,56 @@ def test_xystage_app_init():
 @pytest.fixture
 def port():
     return 1
+
+@pytest.fixture
+def xystage_app():
+    from sim.apps.XYStage import XYStageApp
+    return XYStageApp()
+
+
+class FakeButtons:
+    # stands in for events.input.Buttons with a fixed set of held buttons
+    def __init__(self, held):
+        self.held = set(held)
+
+    def get(self, button):
+        return button in self.held
+
+    def clear(self):
+        self.held = set()
+
+
+@pytest.mark.parametrize("names", [
+    (),
+    ("CANCEL",),
+    ("CONFIRM",),
+    ("UP",),
+    ("DOWN",),
+    ("LEFT",),
+    ("RIGHT",),
+    ("UP", "RIGHT"),
+    ("CANCEL", "CONFIRM", "UP", "DOWN", "LEFT", "RIGHT"),
+])
+def test_get_buttons_mask(xystage_app, names):
+    import sim.apps.XYStage.app as XYStage
+    from events.input import BUTTON_TYPES
+    masks = {"CANCEL": XYStage._MASK_CANCEL, "CONFIRM": XYStage._MASK_CONFIRM,
+             "UP": XYStage._MASK_UP, "DOWN": XYStage._MASK_DOWN,
+             "LEFT": XYStage._MASK_LEFT, "RIGHT": XYStage._MASK_RIGHT}
+    xystage_app.button_states = FakeButtons(BUTTON_TYPES[name] for name in names)
+    expected = 0
+    for name in names:
+        expected |= masks[name]
+    assert xystage_app._get_buttons() == expected
+
+
+def test_default_all_only_persists_changed_settings(xystage_app, monkeypatch):
+    import sim.apps.XYStage.app as XYStage
+    persisted = []
+    monkeypatch.setattr(XYStage.settings, "set", lambda key, value: persisted.append((key, value)))
+    xystage_app._settings['width'].v = xystage_app._settings['width'].d + 10
+    xystage_app._settings['logging'].v = not xystage_app._settings['logging'].d
+    xystage_app._settings_menu_select_handler("DEFAULT ALL", 1)
+    assert sorted(persisted) == [("xystage.logging", None), ("xystage.width", None)]
+    for setting in xystage_app._settings.values():
+        assert setting.v == setting.d